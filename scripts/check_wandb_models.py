@@ -1,7 +1,18 @@
 # file: scripts/check_wandb_models.py
 import os
+import re
+import sys
+import gzip
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import urllib3
 import wandb
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential_jitter
 from wandb.errors import CommError
 import dataikuapi
 from dataikuapi import DSSClient
@@ -22,9 +33,29 @@ DATAIKU_INFRA_ID_PROD = os.getenv('DATAIKU_INFRA_ID_PROD')
 RUN_TESTS_ONLY = os.getenv('RUN_TESTS_ONLY', 'false').lower() == 'true'
 PYTHON_SCRIPT = os.getenv('PYTHON_SCRIPT', 'tests.py')
 CLIENT_CERTIFICATE = os.getenv('CLIENT_CERTIFICATE', None)
+WANDB_CACHE_PATH = os.path.join(os.getenv('RUNNER_TEMP', tempfile.gettempdir()), 'wandb_artifacts.json.gz')
+WANDB_CACHE_TTL = os.getenv('WANDB_CACHE_TTL', '600')  # seconds, 0 disables the cache
+MODEL_ARTIFACT_TYPE = 'model'
+_ARTIFACT_NAME_PAT = re.compile(r"^dataiku-([^-]+)-([^:]+):(.+)$")  # dataiku-<sm>-<ver>:v<n>
 
 #WANDB_API_KEY        = os.getenv("WANDB_API_KEY")
 
+# Fail fast on misconfiguration, before any network connection is opened
+required = {
+    'DATAIKU_INSTANCE_DEV_URL': DATAIKU_INSTANCE_DEV_URL,
+    'DATAIKU_API_TOKEN_DEV': DATAIKU_API_TOKEN_DEV,
+    'DATAIKU_PROJECT_KEY': DATAIKU_PROJECT_KEY,
+}
+missing = [name for name, value in required.items() if not value]
+config_errors = []
+if missing:
+    config_errors.append(f"Missing required environment variables: {', '.join(missing)}")
+try:
+    WANDB_CACHE_TTL = int(WANDB_CACHE_TTL)
+except ValueError:
+    config_errors.append(f"WANDB_CACHE_TTL must be a whole number of seconds, got {WANDB_CACHE_TTL!r}")
+if config_errors:
+    raise RuntimeError("; ".join(config_errors))
 
 # Connect to DSS
 client = dataikuapi.DSSClient(DATAIKU_INSTANCE_DEV_URL, DATAIKU_API_TOKEN_DEV, no_check_certificate=True, client_certificate=CLIENT_CERTIFICATE)
@@ -48,61 +79,222 @@ if not secret_value:
 wandb.login(key=secret_value)
 api = wandb.Api()
 
+# The walk stops early once every (sm, ver) resolved from Dataiku has a hit
+_index_lock = threading.Lock()
+_needed, _found = None, set()
+_all_found = threading.Event()
+# Set when the main thread gives up, so pending workers don't hold up exit
+_walk_aborted = threading.Event()
+# Caps in-flight W&B requests across workers to stay under server rate limits
+_wandb_slots = threading.Semaphore(8)
+
+
+def _set_needed(keys):
+    global _needed
+    with _index_lock:
+        _needed = set(keys)
+        if _needed <= _found:
+            _all_found.set()
+
+
+def _next_artifact(artifacts):
+    with _wandb_slots:
+        return next(artifacts, None)
+
+
+def _iter_model_artifacts(collection):
+    artifacts = iter(collection.artifacts())
+    while not (_all_found.is_set() or _walk_aborted.is_set()):
+        artifact = _next_artifact(artifacts)
+        if artifact is None:
+            return
+        t = artifact.type
+        if t is not None and t.lower() == MODEL_ARTIFACT_TYPE:
+            # e.g. ("dataiku-<sm>-<ver>:v0", "entity/project/artifact:version")
+            yield artifact.source_name, artifact.qualified_name
+
+
+# A paginator that raised mid-page is left one item ahead, so a retry restarts
+# the whole collection and entries already indexed are not appended again
+@retry(
+    retry=retry_if_exception_type(CommError),
+    wait=wait_exponential_jitter(initial=1, max=30),
+    stop=stop_after_attempt(6),
+    reraise=True,
+)
+def _collect(collection, index):
+    for name, path in _iter_model_artifacts(collection):
+        m = _ARTIFACT_NAME_PAT.match(name)
+        if not m:
+            continue
+        entry = {"name": name, "path": path}
+        key = m.group(1, 2)
+        with _index_lock:
+            entries = index[key]
+            if entry not in entries:
+                entries.append(entry)
+            _found.add(key)
+            if _needed is not None and _needed <= _found:
+                _all_found.set()
+
+
+def _load_cached_index(key):
+    # A missing, corrupt or unexpectedly shaped cache file is treated as a miss
+    try:
+        with gzip.open(WANDB_CACHE_PATH, "rt", encoding="utf-8") as f:
+            cached = json.load(f)
+        if cached["key"] != key or time.time() - cached["created"] > WANDB_CACHE_TTL:
+            return None
+        index = defaultdict(list)
+        for sm, ver, entries in cached["index"]:
+            index[(str(sm), str(ver))] = [{"name": str(e["name"]), "path": str(e["path"])} for e in entries]
+        return index, bool(cached.get("complete", False))
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+
+def _save_cached_index(key, index, complete):
+    payload = {
+        "key": key,
+        "created": time.time(),
+        "complete": complete,
+        "index": [[sm, ver, entries] for (sm, ver), entries in index.items()],
+    }
+    try:
+        with gzip.open(WANDB_CACHE_PATH, "wt", encoding="utf-8") as f:
+            json.dump(payload, f)
+    except OSError as e:
+        print(f"W&B DEBUG: Could not write artifact cache {WANDB_CACHE_PATH}: {e}")
+
+
+# Collect ALL W&B model artifacts once, fetching each collection in parallel
+def _enumerate_wandb_artifacts(api, use_cache=True):
+    """Return (index, complete, from_cache) for W&B model artifacts keyed by (saved model id, version id).
+
+    complete is False when the walk stopped early, so only the first matches may be indexed.
+    """
+    try:
+        collections = list(api.registries().collections())
+    except CommError as e:
+        raise RuntimeError(f"Failed to list W&B collections: {e}")
+
+    # Reuse a recent walk of the same registry instead of re-fetching every artifact.
+    # The caller re-walks if the cached index lacks any saved model it needs.
+    cache_key = hashlib.sha256(
+        "\n".join([str(api.default_entity)] + sorted(c.name for c in collections)).encode("utf-8")
+    ).hexdigest()
+    if use_cache and WANDB_CACHE_TTL > 0:
+        cached = _load_cached_index(cache_key)
+        if cached is not None:
+            return cached + (True,)
+
+    index, errors = defaultdict(list), []
+    with ThreadPoolExecutor(max_workers=16) as ex:
+        futures = {ex.submit(_collect, c, index): c for c in collections}
+        for f in as_completed(futures):
+            try:
+                f.result()
+            except CommError as e:
+                errors.append(f"{futures[f].name}: {e}")
+
+    if errors:
+        raise RuntimeError("Failed to list W&B artifacts:\n  " + "\n  ".join(errors))
+    if _walk_aborted.is_set():
+        return index, False, False
+    complete = not _all_found.is_set()
+    if WANDB_CACHE_TTL > 0:
+        _save_cached_index(cache_key, index, complete)
+    return index, complete, False
+
+
 # List DSS saved models
-saved_model_ids = [sm["id"] for sm in project.list_saved_models()]
-if not saved_model_ids:
+saved_models = project.list_saved_models()
+if not saved_models:
     print("W&B DEBUG: No saved models found in Dataiku.")
     exit(0)
 
-# Collect ALL W&B model artifacts once
-artifacts = []
+# Walk the W&B registry in the background while Dataiku is queried below
+wandb_pool = ThreadPoolExecutor(max_workers=1)
+wandb_future = wandb_pool.submit(_enumerate_wandb_artifacts, api)
+wandb_pool.shutdown(wait=False)
+
+
+# Resolve each saved model's active version, in parallel where the listing lacks it
+def _listed_active_id(entry):
+    for field in ("activeVersion", "lastActiveVersion"):
+        version = entry.get(field)
+        if isinstance(version, dict):
+            version = version.get("id")
+        if version:
+            return version
+    return None
+
+
+def _resolve(entry):
+    sm = entry["id"]
+    active_id = _listed_active_id(entry)
+    if active_id is None:
+        active_id = project.get_saved_model(sm).get_active_version()["id"]
+    return sm, active_id
+
+
 try:
-    for collection in api.registries().collections():
-        for artifact in collection.artifacts():
-            if artifact.type and artifact.type.lower() == "model":
-                artifacts.append({
-                    "collection": collection.name,
-                    "artifact": artifact.source_name,   # e.g. "dataiku-<sm>-<ver>:v0"
-                    "path": artifact.qualified_name     # e.g. "entity/project/artifact:version"
-                })
-except CommError as e:
-    raise RuntimeError(f"Failed to list W&B artifacts: {e}")
-
-artifact_names = [{"name": a["artifact"], "path": a["path"]} for a in artifacts]
-any_published = False
+    with ThreadPoolExecutor(max_workers=8) as ex:
+        active_versions = list(ex.map(_resolve, saved_models))
+except BaseException:
+    # Interpreter exit joins the walk's threads, so stop them before bailing out
+    _walk_aborted.set()
+    raise
+_set_needed(active_versions)
+
+index, complete, from_cache = wandb_future.result()
+if from_cache and not _needed <= index.keys():
+    print("W&B DEBUG: Cached artifact index is missing saved models, re-walking the registry.")
+    index, complete, _ = _enumerate_wandb_artifacts(api, use_cache=False)
+
+
+# Order artifacts by their numeric W&B version so v10 sorts after v2
+def _version_order(art):
+    m = _ARTIFACT_NAME_PAT.match(art["name"])
+    version = m.group(3) if m else ""
+    if version[:1] == "v" and version[1:].isdigit():
+        return 0, int(version[1:]), art["name"]
+    return 1, 0, art["name"]
 
-for sm in saved_model_ids:
-    print("✅----- Checking Model(s) in Dataiku -----")
-    print(f"Dataiku Current Saved Model : {sm}")
 
-    model = project.get_saved_model(sm)
-    active_id = model.get_active_version()["id"]
-    _ = model.get_version_details(active_id)  # placeholder for future use
+any_published = False
+buf = []
+
+for sm, active_id in active_versions:
+    buf.append("✅----- Checking Model(s) in Dataiku -----")
+    buf.append(f"Dataiku Current Saved Model : {sm}")
 
     model_identifier = f"dataiku-{sm}-{active_id}"
-    print(f"Dataiku Model Identifier  : {model_identifier}")
-    print("----- Checking if Model exists in W&B -----")
+    buf.append(f"Dataiku Model Identifier  : {model_identifier}")
+    buf.append("----- Checking if Model exists in W&B -----")
 
-    candidate_artifacts = [a for a in artifact_names if model_identifier in a["name"]]
+    candidate_artifacts = index.get((sm, active_id), [])
 
     if not candidate_artifacts:
-        print("⚠️  No published W&B artifacts found for this model.\n")
+        buf.append("⚠️  No published W&B artifacts found for this model.\n")
         continue
 
     any_published = True
-    for art in candidate_artifacts:
+    if not complete:
+        buf.append("   (registry walk stopped at the first match, other W&B versions may exist)")
+    for art in sorted(candidate_artifacts, key=_version_order):
         wb_name_full = art["name"]               # e.g. "dataiku-4wUI1vp8-1702915444643:v0"
-        if ":" in wb_name_full:
-            wb_name_base, wb_version = wb_name_full.split(":", 1)
-        else:
-            wb_name_base, wb_version = wb_name_full, None
-
-        print("✅ Published Model Found in W&B")
-        print(f"   Full Artifact Name : {wb_name_full}")
-        print(f"   Base Name          : {wb_name_base}")
-        print(f"   W&B Version        : {wb_version}")
-        print(f"   Registry Path      : {art['path']}")
-        print("------------------------------")
+        wb_name_base, _, wb_version = wb_name_full.partition(":")
+        wb_version = wb_version or None
+
+        buf.append("✅ Published Model Found in W&B")
+        buf.append(f"   Full Artifact Name : {wb_name_full}")
+        buf.append(f"   Base Name          : {wb_name_base}")
+        buf.append(f"   W&B Version        : {wb_version}")
+        buf.append(f"   Registry Path      : {art['path']}")
+        buf.append("------------------------------")
+
+sys.stdout.write("\n".join(buf) + "\n")
 
 if not any_published:
     print("🛑 W&B DEBUG: No models are published to W&B for any saved models.")